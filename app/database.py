@@ -1,17 +1,46 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String
+from typing import Optional
+from sqlalchemy import create_engine, event, update, Column, Integer, String
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 
 # SQLite Database URL
 SQLALCHEMY_DATABASE_URL = "sqlite:///./indic_scribe.db"
 
 # Create Database Engine
+# QueuePool is chosen explicitly: each checked-out session gets its own SQLite
+# connection (and transaction), and connections are reused so the PRAGMA setup
+# below runs once per connection rather than per request. StaticPool would share
+# a single connection - and therefore a single transaction - across threads.
+# No pool_pre_ping: a local SQLite file never drops connections, so the extra
+# round-trip on every checkout buys nothing.
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_timeout=30,
 )
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection.
+    WAL lets readers run alongside the single writer, and synchronous=NORMAL
+    drops the fsync on each commit (still durable at WAL checkpoints).
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
 # SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit so RETURNING results don't trigger a refresh SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Base class for models
 Base = declarative_base()
@@ -20,8 +49,10 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
-    google_id = Column(String, unique=True, index=True)
+    # The INTEGER primary key is SQLite's rowid; a separate index on it is pure write overhead
+    id = Column(Integer, primary_key=True)
+    # OIDC caps `sub` at 255 ASCII characters (Google's are 21 digits)
+    google_id = Column(String(255), unique=True, index=True)
     email = Column(String)
     name = Column(String)
     picture = Column(String)  # Stores the URL
@@ -34,32 +65,60 @@ Base.metadata.create_all(bind=engine)
 # --- Helper Functions ---
 def get_or_create_user(db, user_info: dict):
     """
-    Check if a user exists by google_id.
-    If yes, return the user.
-    If no, create a new user with default free credits and save to DB.
+    Upsert a user by google_id in a single INSERT ... ON CONFLICT ... RETURNING.
+    New users are created with default free credits; existing users keep their
+    credits and get their Google profile (email, name, picture) refreshed.
     """
-    google_id = user_info.get("sub")
-    email = user_info.get("email")
-    name = user_info.get("name")
-    picture = user_info.get("picture")
+    stmt = sqlite_insert(User).values(
+        google_id=user_info.get("sub"),
+        email=user_info.get("email"),
+        name=user_info.get("name"),
+        picture=user_info.get("picture"),
+        ocr_credits=10,
+        voice_credits_seconds=120
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.google_id],
+        set_={
+            "email": stmt.excluded.email,
+            "name": stmt.excluded.name,
+            "picture": stmt.excluded.picture,
+        },
+    ).returning(User)
 
-    user = db.query(User).filter(User.google_id == google_id).first()
-    
-    if not user:
-        user = User(
-            google_id=google_id,
-            email=email,
-            name=name,
-            picture=picture,
-            ocr_credits=10,
-            voice_credits_seconds=120
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        
+    user = db.scalars(stmt, execution_options={"populate_existing": True}).one()
+    db.commit()
     return user
 
+def deduct_ocr_credit(db, user_id: int, amount: int = 1) -> Optional[int]:
+    """
+    Atomically deduct OCR credits from a user.
+    Runs a single conditional UPDATE ... RETURNING so concurrent requests cannot
+    overdraw and the new balance comes back without a second query. Multi-page
+    or batched work should pass the total as `amount` rather than looping, so it
+    costs one statement and one commit.
+    Returns the remaining credits, or None if the user had fewer than `amount` left.
+    """
+    remaining = db.execute(
+        update(User)
+        .where(User.id == user_id, User.ocr_credits >= amount)
+        .values(ocr_credits=User.ocr_credits - amount)
+        .returning(User.ocr_credits)
+    ).scalar_one_or_none()
+    db.commit()
+    return remaining
+
+def refund_ocr_credit(db, user_id: int, amount: int = 1) -> Optional[int]:
+    """Give back OCR credits that were deducted for a request that failed"""
+    remaining = db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(ocr_credits=User.ocr_credits + amount)
+        .returning(User.ocr_credits)
+    ).scalar_one_or_none()
+    db.commit()
+    return remaining
+
 def get_db():
     """Dependency to get the database session"""
     db = SessionLocal()
@@ -3,22 +3,24 @@ Indic Scribe - OCR Application
 FastAPI server for optical character recognition and speech-to-text
 """
 import os
+import hashlib
 import logging
 import time
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import IO, Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
 from app.services.auth import oauth
-from app.database import get_db, get_or_create_user, User
+from app.database import get_db, get_or_create_user, deduct_ocr_credit, refund_ocr_credit, User
 import tempfile
-import shutil
 from pydantic import BaseModel, Field
+from diskcache import Cache
 
 # Configure logging with a more structured format
 logging.basicConfig(
@@ -44,10 +46,12 @@ if google_credentials_path:
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_credentials_path
 
 # Import Google client after credentials are set
-from app.services.google_client import get_google_client
+from app.services.google_client import get_google_client, OCRError, PageRangeError
 
 # Initialize FastAPI application
+# orjson (Rust) encodes large extracted-text payloads far faster than stdlib json
 app = FastAPI(
+    default_response_class=ORJSONResponse,
     title="Indic Scribe",
     description="Advanced OCR and Speech-to-Text Application for Indic Languages",
     version="1.2.0",
@@ -69,14 +73,33 @@ app.add_middleware(
 )
 
 # Security Headers Middleware
+# Content-Security-Policy, one directive per entry, joined and encoded once at import
+_CSP_DIRECTIVES = (
+    "default-src 'self' https://cdn.tailwindcss.com https://cdn.quilljs.com https://cdnjs.cloudflare.com https://fonts.googleapis.com https://fonts.gstatic.com",
+    "style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://cdn.quilljs.com https://fonts.googleapis.com",
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.tailwindcss.com https://cdn.quilljs.com https://cdnjs.cloudflare.com https://cdn.jsdelivr.net",
+    "img-src 'self' data: blob:",
+)
+CSP_BYTES = ("; ".join(_CSP_DIRECTIVES) + ";").encode("ascii")
+
+# Encoded once at import so each response only extends its raw header list
+_NOSNIFF_HEADER = (b"x-content-type-options", b"nosniff")
+_SECURITY_HEADERS = [
+    _NOSNIFF_HEADER,
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"content-security-policy", CSP_BYTES),
+]
+
 @app.middleware("http")
 async def add_security_headers(request, call_next):
     response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self' https://cdn.tailwindcss.com https://cdn.quilljs.com https://cdnjs.cloudflare.com https://fonts.googleapis.com https://fonts.gstatic.com; style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com https://cdn.quilljs.com https://fonts.googleapis.com; script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.tailwindcss.com https://cdn.quilljs.com https://cdnjs.cloudflare.com https://cdn.jsdelivr.net; img-src 'self' data: blob:;"
+    # Static assets are not documents and only need nosniff, so JS/CSS are never MIME-sniffed
+    if request.url.path.startswith("/static/"):
+        response.raw_headers.append(_NOSNIFF_HEADER)
+    else:
+        response.raw_headers.extend(_SECURITY_HEADERS)
     return response
 
 # Global Exception Handler
@@ -90,20 +113,110 @@ async def global_exception_handler(request, exc):
     )
 
 # Mount static files
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that adds a fixed Cache-Control header to every file it serves"""
+
+    def __init__(self, *args, cache_control: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+# JS modules under /static are not fingerprinted, so keep their cache lifetime modest
+STATIC_CACHE_MAX_AGE = int(os.getenv("STATIC_CACHE_MAX_AGE", 3600))
+
+# Resolved once at import; nothing on the request path touches the filesystem layout
 static_dir = Path(__file__).parent.parent / "static"
+INDEX_PATH = static_dir / "index.html"
+INDEX_EXISTS = INDEX_PATH.exists()
+
 if static_dir.exists():
-    app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+    app.mount(
+        "/static",
+        CachedStaticFiles(directory=str(static_dir), cache_control=f"public, max-age={STATIC_CACHE_MAX_AGE}"),
+        name="static",
+    )
+
+# --- OCR Result Cache ---
+
+# Exact-match cache of OCR output keyed by upload content hash and page range.
+# Re-uploads of the same document (client retries, repeated test files) skip Vision entirely.
+ocr_cache = Cache(
+    os.getenv("OCR_CACHE_DIR", "./ocr_cache"),
+    size_limit=int(os.getenv("OCR_CACHE_SIZE_LIMIT", 2 * 1024 ** 3)),
+)
+
+def _ocr_cache_key(content_digest: str, page_start: Optional[int], page_end: Optional[int]) -> str:
+    """Build the OCR cache key from the upload's SHA-256 and the requested page range"""
+    return f"ocr:{content_digest}:{page_start}:{page_end}"
+
+# --- Upload Helpers ---
+
+# Read uploads in 1 MiB blocks
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Uploads up to this size are OCR'd from memory; larger ones are spilled to disk
+INLINE_OCR_MAX_BYTES = int(os.getenv("INLINE_OCR_MAX_BYTES", 8 * 1024 * 1024))
+
+async def _receive_upload(file: UploadFile) -> Tuple[str, Optional[bytes], Optional[IO[bytes]]]:
+    """
+    Read an upload in a single pass, hashing it for the OCR cache as it streams.
+    Returns (sha256 hex digest, in-memory bytes, spill file). Uploads up to
+    INLINE_OCR_MAX_BYTES come back as bytes; larger ones are written to a
+    NamedTemporaryFile (deleted on close) which the caller must close.
+    """
+    digest = hashlib.sha256()
+    chunks: List[bytes] = []
+    size = 0
+    spill_file = None
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            if spill_file is None and size <= INLINE_OCR_MAX_BYTES:
+                chunks.append(chunk)
+                continue
+            
+            if spill_file is None:
+                spill_file = tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix)
+                chunks.append(chunk)
+                chunk = b"".join(chunks)
+                chunks.clear()
+            await run_in_threadpool(spill_file.write, chunk)
+        
+        if spill_file is not None:
+            await run_in_threadpool(spill_file.flush)
+    except BaseException:
+        if spill_file is not None:
+            spill_file.close()
+        raise
+    
+    if spill_file is not None:
+        return digest.hexdigest(), None, spill_file
+    return digest.hexdigest(), b"".join(chunks), None
 
 # --- Lifecycle ---
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize Google Cloud client on startup"""
+    """Initialize Google Cloud client on startup and cache its service handles"""
+    app.state.vision_service = None
     try:
-        get_google_client()
+        app.state.vision_service = get_google_client().get_vision_service()
         logger.info("✓ Google Cloud Stack initialized successfully")
     except Exception as e:
         logger.error(f"⚠ Critical Error: Failed to initialize Google Cloud client: {e}")
+        return
+    
+    # Bring up the optional PDF extraction workers now rather than inside a request.
+    # They are spawned, so each one imports this module once, at startup.
+    try:
+        await run_in_threadpool(app.state.vision_service.start_extract_pool)
+    except Exception as e:
+        logger.error(f"⚠ PDF extraction pool failed to start; extracting serially: {e}")
 
 # --- Authentication Endpoints ---
 
@@ -121,11 +234,12 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
     
     if user_info:
         # Get or create the user in our database
-        user = get_or_create_user(db, user_info)
+        user = await run_in_threadpool(get_or_create_user, db, user_info)
         
         # Store user details in session cookie
         request.session['user_id'] = user.id
         request.session['email'] = user.email
+        _cache_user_in_session(request, user)
         
     return RedirectResponse(url='/')
 
@@ -137,16 +251,38 @@ async def logout(request: Request):
 
 # --- Dependencies ---
 
+# Profile fields kept in the signed session cookie so read-only requests skip the database
+_SESSION_USER_FIELDS = ("id", "name", "picture", "ocr_credits", "voice_credits_seconds")
+
+def _cache_user_in_session(request: Request, user: User) -> None:
+    """Store a lightweight snapshot of the user's profile in the session"""
+    request.session['user_cache'] = {field: getattr(user, field) for field in _SESSION_USER_FIELDS}
+
+def _update_session_credits(request: Request, ocr_credits: Optional[int]) -> None:
+    """Keep the cached OCR credit balance in step with the database"""
+    user_cache = request.session.get('user_cache')
+    if user_cache is not None and ocr_credits is not None:
+        request.session['user_cache'] = {**user_cache, "ocr_credits": ocr_credits}
+
 async def get_current_user(request: Request, db: Session = Depends(get_db)):
-    """FastAPI Dependency to get the current user from the session"""
+    """
+    FastAPI Dependency to get the current user from the session.
+    Returns a detached User built from the session cache when available;
+    the database is only queried when the cache is missing.
+    """
     user_id = request.session.get('user_id')
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated. Please log in.")
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user_cache = request.session.get('user_cache')
+    if user_cache and user_cache.get("id") == user_id:
+        return User(**user_cache)
+    
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.id == user_id).first())
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-        
+    
+    _cache_user_in_session(request, user)
     return user
 
 # --- Existing Endpoints ---
@@ -156,18 +292,6 @@ async def health_check() -> Dict[str, str]:
     """Health check endpoint"""
     return {"status": "Google Stack Active"}
 
-@app.get("/")
-async def root():
-    """Serve the main application HTML"""
-    index_path = Path(__file__).parent.parent / "static" / "index.html"
-    if index_path.exists():
-        return FileResponse(index_path, media_type="text/html")
-    return {
-        "message": "Welcome to Indic Scribe",
-        "version": "1.1.0",
-        "documentation": "/docs",
-    }
-
 @app.get("/api/me")
 async def get_current_user_profile(user: User = Depends(get_current_user)):
     """Return the currently authenticated user's profile and credits"""
@@ -181,6 +305,7 @@ async def get_current_user_profile(user: User = Depends(get_current_user)):
 
 @app.post("/api/ocr", response_model=OCRResponse)
 async def ocr(
+    request: Request,
     file: UploadFile = File(...),
     page_start: Optional[int] = Form(None),
     page_end: Optional[int] = Form(None),
@@ -191,49 +316,129 @@ async def ocr(
     Extract text from images and PDFs using advanced hybrid OCR with automatic language detection.
     """
     try:
-        # Check credits before processing
-        if user.ocr_credits <= 0:
-            raise HTTPException(status_code=402, detail="Payment Required: Not enough OCR credits")
-            
         # Validate file
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
+        if page_start is not None and page_end is not None and page_start > page_end:
+            raise HTTPException(status_code=400, detail="page_start must not be greater than page_end")
         
         logger.info(f"OCR request: {file.filename} ({file.content_type})")
         start_time = time.time()
         
-        # Save to temporary file to avoid keeping large bytes in memory
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_path = tmp_file.name
-        
+        content_digest, file_bytes, spill_file = await _receive_upload(file)
         try:
-            # Process OCR using the file path
-            google_client = get_google_client()
-            vision_service = google_client.get_vision_service()
-            
-            logger.info(f"Running text detection on {tmp_path} (auto-lang)...")
-            extracted_text = vision_service.detect_text_from_path(tmp_path, page_start=page_start, page_end=page_end)
+            if file_bytes == b"":
+                raise HTTPException(status_code=400, detail="Uploaded file is empty")
             
-            processing_time = time.time() - start_time
-            logger.info(f"OCR complete in {processing_time:.2f}s")
+            # Identical uploads are served from the cache without spending a credit
+            cache_key = _ocr_cache_key(content_digest, page_start, page_end)
+            cached_text = await run_in_threadpool(ocr_cache.get, cache_key)
+            if cached_text is not None:
+                processing_time = time.time() - start_time
+                logger.info(f"OCR cache hit in {processing_time:.2f}s")
+                return OCRResponse(text=cached_text, processing_time_seconds=processing_time)
             
-            # Deduct credit
-            user.ocr_credits -= 1
-            db.commit()
+            # Reserve a credit up front so exhausted accounts never reach the Vision API
+            remaining_credits = await run_in_threadpool(deduct_ocr_credit, db, user.id)
+            if remaining_credits is None:
+                _update_session_credits(request, 0)
+                raise HTTPException(status_code=402, detail="Payment Required: Not enough OCR credits")
+            _update_session_credits(request, remaining_credits)
             
-            return OCRResponse(text=extracted_text or "", processing_time_seconds=processing_time)
+            try:
+                vision_service = request.app.state.vision_service
+                if vision_service is None:
+                    raise HTTPException(status_code=503, detail="OCR service is unavailable")
+                
+                if file_bytes is not None:
+                    # Small uploads go straight to the Vision service without touching disk
+                    logger.info(f"Running text detection on {len(file_bytes)} bytes in memory (auto-lang)...")
+                    extracted_text = await run_in_threadpool(
+                        vision_service.detect_text,
+                        file_bytes,
+                        page_start=page_start,
+                        page_end=page_end,
+                        content_digest=content_digest,
+                    )
+                else:
+                    # Large PDFs were spilled to a temporary file to avoid keeping large bytes in memory
+                    logger.info(f"Running text detection on {spill_file.name} (auto-lang)...")
+                    extracted_text = await run_in_threadpool(
+                        vision_service.detect_text_from_path,
+                        spill_file.name,
+                        page_start=page_start,
+                        page_end=page_end,
+                        content_digest=content_digest,
+                    )
+            except Exception:
+                # Give the reserved credit back if OCR itself failed (the service raises
+                # OCRError rather than returning partial error text)
+                _update_session_credits(request, await run_in_threadpool(refund_ocr_credit, db, user.id))
+                raise
         finally:
-            # Always clean up the temporary file
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            if spill_file is not None:
+                spill_file.close()
+        
+        if extracted_text:
+            await run_in_threadpool(ocr_cache.set, cache_key, extracted_text)
+        
+        processing_time = time.time() - start_time
+        logger.info(f"OCR complete in {processing_time:.2f}s")
+        
+        return OCRResponse(text=extracted_text, processing_time_seconds=processing_time)
         
     except HTTPException:
         raise
+    except PageRangeError as e:
+        # Refunded like any other OCR failure; the request itself was at fault
+        raise HTTPException(status_code=400, detail=str(e))
+    except OCRError as e:
+        # The upstream OCR backend failed; the credit has already been refunded
+        logger.error(f"OCR failed: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         logger.error(f"Error in OCR: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Frontend ---
+
+# Mounted last so every API route above takes precedence over the catch-all "/" mount.
+# index.html is revalidated on each visit (ETag/304) so deploys are picked up immediately.
+if INDEX_EXISTS:
+    app.mount(
+        "/",
+        CachedStaticFiles(directory=str(static_dir), html=True, cache_control="no-cache"),
+        name="root",
+    )
+else:
+    @app.get("/")
+    async def root():
+        """Fallback landing response when the frontend is not bundled"""
+        return {
+            "message": "Welcome to Indic Scribe",
+            "version": "1.1.0",
+            "documentation": "/docs",
+        }
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # uvloop + httptools cut event-loop and multipart parsing overhead on the upload path.
+    # Set UVICORN_RELOAD=true for local development (single worker, auto-reload).
+    # For multi-worker production deployments under gunicorn, give the worker count through
+    # WEB_CONCURRENCY (not -w) so the Vision rate limit is split across the workers:
+    #   WEB_CONCURRENCY=$((2 * $(nproc) + 1)) gunicorn app.main:app -k uvicorn.workers.UvicornWorker
+    # UVICORN_LOOP=none leaves loop setup to an externally installed event loop policy,
+    # e.g. an io_uring-backed loop once one is production ready.
+    reload = os.getenv("UVICORN_RELOAD", "false").lower() == "true"
+    workers = None if reload else int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+    # Worker processes inherit this and divide VISION_MAX_RPS by it
+    os.environ["WEB_CONCURRENCY"] = str(workers or 1)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop=os.getenv("UVICORN_LOOP", "uvloop"),
+        http="httptools",
+        reload=reload,
+        workers=workers,
+    )
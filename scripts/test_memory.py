@@ -6,19 +6,47 @@ import psutil
 # Configuration
 API_URL = "http://localhost:8000/api/ocr"
 LARGE_PDF_PATH = "test_large.pdf" # User should provide this or we simulate
+SERVER_PID = os.getenv("SERVER_PID") # Set this when the server can't be found by its command line
 
-def log_memory():
-    process = psutil.Process(os.getpid())
-    mem = process.memory_info().rss / (1024 * 1024)
-    print(f"Memory Usage: {mem:.2f} MB")
+def find_server_process():
+    """Locate the running OCR server: SERVER_PID if given, else the top-most process serving app.main"""
+    if SERVER_PID:
+        return psutil.Process(int(SERVER_PID))
+
+    candidates = {}
+    for proc in psutil.process_iter(["pid", "ppid", "cmdline"]):
+        args = proc.info["cmdline"] or []
+        serves_app = any(arg.startswith("app.main") or arg.endswith("app/main.py") for arg in args)
+        if serves_app and proc.info["pid"] != os.getpid():
+            candidates[proc.info["pid"]] = proc
+    for pid, proc in candidates.items():
+        if proc.info["ppid"] not in candidates:
+            return proc
+    return None
+
+def log_memory(server):
+    """Report the resident memory of the server and its workers (not of this client script)"""
+    if server is None:
+        print("Server process not found; set SERVER_PID to measure its memory")
+        return
+
+    mem = 0
+    processes = [server] + server.children(recursive=True)
+    for process in processes:
+        try:
+            mem += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    print(f"Server Memory Usage: {mem / (1024 * 1024):.2f} MB across {len(processes)} process(es)")
 
 def test_large_pdf_upload():
     if not os.path.exists(LARGE_PDF_PATH):
         print(f"Skipping test: {LARGE_PDF_PATH} not found.")
         return
 
+    server = find_server_process()
     print(f"Testing upload of {LARGE_PDF_PATH}...")
-    log_memory()
+    log_memory(server)
     
     start_time = time.time()
     try:
@@ -38,7 +66,7 @@ def test_large_pdf_upload():
     except Exception as e:
         print(f"Request failed: {e}")
     
-    log_memory()
+    log_memory(server)
 
 if __name__ == "__main__":
     test_large_pdf_upload()